@@ -1,130 +1,243 @@
 from dotenv import load_dotenv
 import os
-import json
-import pandas as pd
+import asyncio
+import csv
+import hashlib
+import shelve
 import re
 from datetime import datetime
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain.agents import initialize_agent, Tool
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage
+
+# orjson has no PyPy build; fall back to the stdlib parser, which PyPy's JIT handles well
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# "gemini" (default) or "ollama" to run against a local Ollama server
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+if LLM_BACKEND not in ("gemini", "ollama"):
+    raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND!r} (expected 'gemini' or 'ollama')")
+
+if LLM_BACKEND == "ollama":
+    # Local model: no WAN round trip; set OLLAMA_NUM_PARALLEL on the server to serve concurrent calls
+    from langchain_ollama import ChatOllama
+    MODEL_NAME = OLLAMA_MODEL
+    llm = ChatOllama(model=MODEL_NAME, temperature=0, format="json")
+else:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # Initialize the Gemini model
+    # Created once and shared by every chain call: its async gRPC channel runs over HTTP/2,
+    # so concurrent paragraph requests multiplex over one warm connection instead of
+    # paying a new TCP+TLS handshake each. Do not build a client per call.
+    MODEL_NAME = "gemini-1.5-flash"
+    llm = ChatGoogleGenerativeAI(
+        model=MODEL_NAME,
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0,
+        # JSON mode: the response body is guaranteed to be a bare JSON object
+        response_mime_type="application/json"
+    )
 
-# Initialize the Gemini model
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    google_api_key=GOOGLE_API_KEY,
-    temperature=0
+# Fixed instructions go in the system message so every call shares the same prefix
+INSTRUCTIONS = (
+    "Extract the company from the paragraph. Dates as YYYY-MM-DD; year only -> Jan 1, year+month -> 1st of month. "
+    "Founders as one comma-separated string. Reply with ONLY compact JSON like:\n"
+    '{"company_name":"Apple Inc.","founding_date":"1976-04-01","founders":"Steve Jobs, Steve Wozniak"}'
 )
 
 # Define the prompt template
-prompt = ChatPromptTemplate.from_template(
-    """
-    You are an intelligent agent tasked with extracting company details from a paragraph. For each paragraph, identify:
-    - S.No. (int)
-    - Company Name (string)
-    - Founding Date (format as YYYY-MM-DD; if only year is provided, use January 1st; if year and month, use 1st of the month)
-    - Founders (list of names as a comma-separated string)
-
-    Input paragraph: {paragraph}
-
-    Return ONLY the extracted information as a valid JSON string:
-    {{"S.No.": "<int>", "company_name": "<string>", "founding_date": "<YYYY-MM-DD>", "founders": "<comma-separated string>"}}
-    """
-)
+prompt = ChatPromptTemplate.from_messages([
+    SystemMessage(content=INSTRUCTIONS),
+    HumanMessagePromptTemplate.from_template("{paragraph}")
+])
 
 # LCEL chain
 chain = prompt | llm | StrOutputParser()
 
 # Validate and fix dates
 def validate_and_fix_date(date_str):
-    parts = date_str.strip().split("-")
-    if len(parts) == 1:  # Year only
-        return f"{parts[0]}-01-01"
-    elif len(parts) == 2:  # Year + month
-        return f"{parts[0]}-{parts[1].zfill(2)}-01"
-    elif len(parts) == 3:  # Full date
-        return f"{parts[0]}-{parts[1].zfill(2)}-{parts[2].zfill(2)}"
-    else:
+    parts = date_str.strip().split("-", 2)
+    try:
+        year = int(parts[0])
+        month = int(parts[1]) if len(parts) > 1 else 1  # Year only -> January
+        day = int(parts[2]) if len(parts) > 2 else 1  # Year + month -> 1st of the month
+    except ValueError:
         raise ValueError(f"Invalid date format: {date_str}")
+    return "%04d-%02d-%02d" % (year, month, day)
+
+# CSV columns; keys outside this list are dropped, missing ones left blank
+FIELDS = ["S.No.", "company_name", "founding_date", "founders"]
+
+# Header of each CSV file already seen, so existing files are only read once
+csv_headers = {}
+
+# Read the header row of an existing CSV, or None if it is missing or empty
+def read_csv_header(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
 
 # Write CSV safely (append mode)
 def write_to_csv(data, filename="company_info.csv"):
-    df = pd.DataFrame(data)
-    # df.insert("S.No.", range(1, len(data) + 1))
-    # Append if file exists
-    if os.path.exists(filename):
-        df.to_csv(filename, mode="a", index=False, header=False)
-    else:
-        df.to_csv(filename, index=False)
+    fieldnames = csv_headers.get(filename) or read_csv_header(filename)
+    new_file = fieldnames is None
+    # Existing files keep their own column order so appended rows line up
+    fieldnames = fieldnames or FIELDS
+    with open(filename, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        writer.writerows(data)
+    csv_headers[filename] = fieldnames
     print(f"CSV file '{filename}' updated successfully")
 
+# Template extractor for the common "<Company> was founded on <date> by <founders> in <place>" sentence
+# The company must start a sentence or clause, so preceding prose is never pulled into the name
+FOUNDING_RE = re.compile(
+    r"(?:^|(?<=\. )|(?<=, ))"
+    r"(?P<company>[A-Z][\w.&'\-]*(?: [A-Z][\w.&'\-]*)*(?:,? (?:Inc|Ltd|LLC|Co)\.?)*),?"
+    r" (?:was )?(?P<verb>founded|established|born|launched) (?:on|in) "
+    r"(?P<date>(?:[A-Z][a-z]+ (?:\d{1,2}, )?)?\d{4}),? by (?P<founders>.+?),? in "
+)
+FOUNDING_VERB_RE = re.compile(r"\b(?:founded|established|born|launched)\b", re.IGNORECASE)
+DATE_FORMATS = ("%B %d, %Y", "%B %Y", "%Y")
+# Capitalized clause openers that can precede a name without a comma ("Meanwhile Microsoft ...")
+OPENER_WORDS = {
+    "In", "On", "At", "By", "After", "Before", "During", "Since", "Then", "Later", "Meanwhile",
+    "Today", "Yesterday", "Also", "Similarly", "Finally", "Eventually", "Originally", "Initially",
+    "January", "February", "March", "April", "May", "June", "July", "August", "September",
+    "October", "November", "December"
+}
+
+def extract_with_template(paragraph):
+    match = FOUNDING_RE.search(paragraph)
+    # Only trust the template when it matches the first founding mention in the paragraph
+    if not match or FOUNDING_VERB_RE.search(paragraph).start() != match.start("verb"):
+        return None
+    if match.group("company").split()[0] in OPENER_WORDS:
+        return None
+    founders = re.split(r",? and |, ", match.group("founders"))
+    # Every founder must look like a full name, e.g. not "18 colleagues" or a lone "Patrick"
+    if not all(len(name.split()) > 1 and all(word[0].isupper() for word in name.split()) for name in founders):
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            founding_date = datetime.strptime(match.group("date"), fmt).strftime("%Y-%m-%d")
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    return {
+        "company_name": match.group("company"),
+        "founding_date": founding_date,
+        "founders": ", ".join(founders)
+    }
+
+# Persistent cache of extraction results, keyed by paragraph hash
+CACHE_FILE = "llm_cache"
+
+# Anything that changes the LLM's answer is part of the key, so switching backend,
+# model or prompt never serves stale entries
+def cache_key(paragraph):
+    return hashlib.blake2b(
+        "\0".join((LLM_BACKEND, MODEL_NAME, INSTRUCTIONS, paragraph)).encode()
+    ).hexdigest()
+
+async def cached_invoke(paragraph):
+    key = cache_key(paragraph)
+    with shelve.open(CACHE_FILE) as cache:
+        if key in cache:
+            return cache[key]
+    data = json_loads(await chain.ainvoke({"paragraph": paragraph}))
+    # JSON mode guarantees valid JSON, not an object; never cache anything else
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object from LLM, got: {data!r}")
+    with shelve.open(CACHE_FILE) as cache:
+        cache[key] = data
+    return data
+
+# Check a template row against the LLM's answer for the same paragraph
+def template_agrees(template_row, llm_row):
+    try:
+        return (
+            template_row["company_name"].casefold() == llm_row["company_name"].strip().casefold()
+            and template_row["founding_date"] == validate_and_fix_date(llm_row["founding_date"])
+            and set(template_row["founders"].split(", "))
+            == {name.strip() for name in llm_row["founders"].split(",")}
+        )
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return False
+
+# Split essay text into non-empty paragraphs
+def split_paragraphs(essay_text):
+    # splitlines handles \r\n too; map/filter keep the per-line work in C
+    return list(filter(None, map(str.strip, essay_text.splitlines())))
+
 # Process essay text
 async def process_essay(essay_text):
-    paragraphs = [p.strip() for p in essay_text.split("\n") if p.strip()]
+    paragraphs = split_paragraphs(essay_text)
+    # Only send each distinct paragraph once, keeping first-seen order
+    unique = list(dict.fromkeys(paragraphs))
+    # Paragraphs matching the common template skip the LLM...
+    template_rows = {p: row for p in unique if (row := extract_with_template(p)) is not None}
+    if template_rows:
+        # ...but only once the template agrees with the LLM on one exemplar this run
+        exemplar = next(iter(template_rows))
+        try:
+            llm_row = await cached_invoke(exemplar)
+        except Exception:
+            llm_row = None
+        if not template_agrees(template_rows[exemplar], llm_row):
+            print("Template extractor disagrees with the LLM; using the LLM for every paragraph")
+            template_rows = {}
+    llm_paragraphs = [p for p in unique if p not in template_rows]
+    # Fire all paragraph calls concurrently instead of one round trip at a time
+    llm_responses = await asyncio.gather(
+        *[cached_invoke(p) for p in llm_paragraphs],
+        return_exceptions=True
+    )
+    # Expand back to one result per paragraph; copy so duplicates don't share a dict
+    by_paragraph = {**template_rows, **dict(zip(llm_paragraphs, llm_responses))}
+    responses = [
+        dict(r) if isinstance(r, dict) else r
+        for r in (by_paragraph[p] for p in paragraphs)
+    ]
     results = []
-    for paragraph in paragraphs:
+    for paragraph, parsed in zip(paragraphs, responses):
         try:
-            response = await chain.ainvoke({"paragraph": paragraph})
-            # Clean JSON if model outputs extra text
-            match = re.search(r"\{.*\}", response, re.DOTALL)
-            if not match:
-                raise ValueError("No valid JSON found in LLM output")
-            parsed = json.loads(match.group())
+            if isinstance(parsed, Exception):
+                raise parsed
             parsed["founding_date"] = validate_and_fix_date(parsed["founding_date"])
             results.append(parsed)
         except Exception as e:
             print(f"Error processing paragraph: {paragraph}\nError: {e}")
+    # Number rows here so template and LLM rows share one schema and sequence
+    for serial, row in enumerate(results, 1):
+        row["S.No."] = serial
     return results
 
-# CSV-writing tool for agent
-def csv_tool_func(input_data):
-    try:
-        if isinstance(input_data, str):
-            match = re.search(r"\{.*\}", input_data, re.DOTALL)
-            if match:
-                parsed = json.loads(match.group())
-            else:
-                raise ValueError("No JSON found in input string")
-        else:
-            parsed = input_data
-        write_to_csv([parsed], "company_info_agent.csv")
-    except Exception as e:
-        return f"Error writing CSV: {e}"
-    return "Data saved to CSV"
-
-csv_tool = Tool(
-    name="CSV_Writer",
-    description="Writes extracted company data to a CSV file. Input should be a JSON string with fields: company_name, founding_date, founders.",
-    func=csv_tool_func
-)
+# Rows queued by the agent tool, written in one go by flush_csv
+AGENT_CSV_FILE = "company_info_agent.csv"
+agent_rows = []
 
-# Initialize agent (default prompt)
-agent = initialize_agent(
-    tools=[csv_tool],
-    llm=llm,
-    agent="zero-shot-react-description",
-    verbose=True
-)
+def flush_csv():
+    if agent_rows:
+        write_to_csv(agent_rows, AGENT_CSV_FILE)
+        agent_rows.clear()
 
-# Process with agent
-async def process_with_agent(paragraph):
-    try:
-        # First, extract JSON with LCEL chain
-        response = await chain.ainvoke({"paragraph": paragraph})
-        match = re.search(r"\{.*\}", response, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON found from extraction")
-        data = json.loads(match.group())
-        # Pass data to the agent tool
-        return await agent.arun(f"Save this data to CSV: {json.dumps(data)}")
-    except Exception as e:
-        print(f"Agent error: {e}")
-        return None
+# CSV-writing tool for agent
+def csv_tool_func(row):
+    agent_rows.append(row)
+    return "Data queued for CSV"
 
 # Main function
 async def main():
@@ -181,12 +294,13 @@ async def main():
     extracted_data = await process_essay(essay)
     write_to_csv(extracted_data)
 
-    # Optionally process with agent (appends separately)
-    for paragraph in essay.split("\n"):
-        if paragraph.strip():
-            await process_with_agent(paragraph)
+    # Optionally save through the agent tool too (appends separately), reusing the extracted rows
+    try:
+        for row in extracted_data:
+            csv_tool_func(row)
+    finally:
+        flush_csv()
 
 # Run script
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
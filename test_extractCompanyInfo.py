@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain_google_genai")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+from extractCompanyInfo import extract_with_template
+
+
+@pytest.mark.parametrize("paragraph", [
+    "Meanwhile Microsoft Corporation was founded on April 4, 1975, by Bill Gates and Paul Allen in Albuquerque.",
+    "In January Apple Inc. was founded on April 1, 1976, by Steve Jobs and Steve Wozniak in Cupertino.",
+    "Yesterday Acme Corp was founded on May 1, 2020, by John Smith in Boston.",
+    "Old news. Yesterday Acme Corp was founded on May 1, 2020, by John Smith in Boston.",
+    "One of the earliest examples is The Coca-Cola Company, founded on May 8, 1886, by Dr. John Stith Pemberton in Atlanta.",
+])
+def test_declines_names_with_leading_prose(paragraph):
+    assert extract_with_template(paragraph) is None
+
+
+def test_extracts_name_after_clause_opener():
+    row = extract_with_template(
+        "Meanwhile, Microsoft Corporation was founded on April 4, 1975, by Bill Gates and Paul Allen in Albuquerque."
+    )
+    assert row == {
+        "company_name": "Microsoft Corporation",
+        "founding_date": "1975-04-04",
+        "founders": "Bill Gates, Paul Allen",
+    }